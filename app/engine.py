@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import uuid
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import orjson
 
 from app.schemas import (
     GraphSpec,
@@ -12,21 +15,70 @@ from app.schemas import (
     StateModel,
 )
 from app.nodes_tools import NODE_FUNCTIONS, registered_tools
+from app.store import RunStore
+
+EdgeDestinations = Dict[Optional[str], Optional[str]]
+PlanStep = Tuple[Callable[..., Any], Optional[Dict[str, Any]], Optional[EdgeDestinations]]
+
+
+class PublishQueue(asyncio.Queue):
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        self.subscribed = False
+        self.closed = False
+        self.dropped_marker: Optional[Dict[str, Any]] = None
+
+    def attach(self) -> None:
+        self.subscribed = True
+
+    def detach(self) -> None:
+        self.subscribed = False
+        self.closed = True
+        while not self.empty():
+            self.get_nowait()
+
+
+class FunctionPool:
+    def __init__(self, sources: Dict[str, str]) -> None:
+        self.sources = sources
+        self.unpublished_ids: Dict[str, None] = {}
+
+    def add(self, source: str) -> str:
+        source_id = hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+        if source_id not in self.sources:
+            self.sources[source_id] = source
+            self.unpublished_ids[source_id] = None
+        return source_id
+
+    def unpublished(self) -> List[Tuple[str, str]]:
+        return [(source_id, self.sources[source_id]) for source_id in self.unpublished_ids]
+
+    def mark_published(self, source_id: str) -> None:
+        self.unpublished_ids.pop(source_id, None)
+
 
 stored_graphs: Dict[str, GraphSpec] = {}
-stored_runs: Dict[str, RunInfo] = {}
-stored_run_queues: Dict[str, asyncio.Queue] = {}
+stored_graph_edges: Dict[str, Dict[str, EdgeDestinations]] = {}
+stored_graph_node_configs: Dict[str, Dict[str, Optional[Dict[str, Any]]]] = {}
+stored_graph_plans: Dict[str, Dict[str, PlanStep]] = {}
+stored_runs: RunStore[RunInfo] = RunStore()
+stored_run_queues: RunStore[PublishQueue] = RunStore()
 
 
 class WorkflowEngine:
     def create_graph(self, graph: GraphSpec) -> str:
         graph_identifier = str(uuid.uuid4())
         stored_graphs[graph_identifier] = graph
+        stored_graph_edges[graph_identifier] = self.build_edges_map(graph)
+        stored_graph_node_configs[graph_identifier] = self.build_node_config_map(graph)
+        stored_graph_plans[graph_identifier] = {}
+        for node in graph.nodes:
+            self.get_plan_step(graph_identifier, node.name)
         return graph_identifier
 
-    def create_run(self, graph_identifier: str, initial_state: Optional[StateModel]) -> str:
+    async def create_run(self, graph_identifier: str, initial_state: Optional[StateModel]) -> str:
         run_identifier = str(uuid.uuid4())
-        run_info = RunInfo(
+        run_info = RunInfo.model_construct(
             run_id=run_identifier,
             graph_id=graph_identifier,
             status=RunStatus.PENDING,
@@ -34,89 +86,113 @@ class WorkflowEngine:
             step_count=0,
             logs=[],
             final_state=None,
+            source_pool={},
         )
-        stored_runs[run_identifier] = run_info
+        await stored_runs.set(run_identifier, run_info)
         if initial_state is None:
             initial_state = StateModel()
         run_info.final_state = initial_state
         return run_identifier
 
-    async def run_workflow(self, run_identifier: str, publish_queue: Optional[asyncio.Queue] = None) -> RunInfo:
-        run_info = stored_runs[run_identifier]
+    async def run_workflow(self, run_identifier: str, publish_queue: Optional[PublishQueue] = None) -> RunInfo:
+        run_info = await stored_runs.get(run_identifier)
         graph = stored_graphs[run_info.graph_id]
         run_info.status = RunStatus.RUNNING
 
         current_state = run_info.final_state or StateModel()
-        current_node_name = graph.start_node
-        run_info.current_node = current_node_name
+        run_info.current_node = graph.start_node
 
-        edges_map = self.build_edges_map(graph)
+        try:
+            await self.execute_steps(run_info, graph, current_state, publish_queue)
+        except Exception as execution_error:
+            log_entry = LogEntry.model_construct(
+                step_index=run_info.step_count,
+                node_name=run_info.current_node or "",
+                state_snapshot={},
+                message=str(execution_error),
+                error=str(execution_error),
+            )
+            run_info.logs.append(log_entry)
+            run_info.status = RunStatus.FAILED
+            await self.publish(publish_queue, {"type": "log", "entry": log_entry})
+            await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
+
+        return run_info
+
+    async def execute_steps(
+        self,
+        run_info: RunInfo,
+        graph: GraphSpec,
+        current_state: StateModel,
+        publish_queue: Optional[PublishQueue],
+    ) -> None:
+        current_node_name = run_info.current_node
+        snapshot_pool: Dict[bytes, Any] = {}
+        function_pool = FunctionPool(run_info.source_pool)
 
         for step_number in range(graph.max_iterations):
-            if current_node_name not in NODE_FUNCTIONS:
+            plan_step = self.get_plan_step(run_info.graph_id, current_node_name)
+            if plan_step is None:
                 run_info.status = RunStatus.FAILED
                 run_info.final_state = current_state
-                if publish_queue is not None:
-                    await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+                await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
                 break
 
-            node_function = NODE_FUNCTIONS[current_node_name]
-            node_config = self.get_node_config(graph, current_node_name)
+            node_function, node_config, destinations = plan_step
 
             try:
                 next_key, updated_state, message = await node_function(
                     current_state, registered_tools, node_config
                 )
             except Exception as execution_error:
-                log_entry = LogEntry(
+                log_entry = LogEntry.model_construct(
                     step_index=step_number,
                     node_name=current_node_name,
-                    state_snapshot=current_state.dict(),
+                    state_snapshot=self.snapshot_state(
+                        current_state, graph, publish_queue, snapshot_pool, function_pool
+                    ),
                     message=str(execution_error),
                     error=str(execution_error),
                 )
                 run_info.logs.append(log_entry)
                 run_info.status = RunStatus.FAILED
                 run_info.final_state = current_state
-                if publish_queue is not None:
-                    await publish_queue.put({"type": "log", "entry": log_entry.dict()})
-                    await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+                await self.publish_log(publish_queue, log_entry, function_pool)
+                await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
                 break
 
             current_state = updated_state
-            log_entry = LogEntry(
+            log_entry = LogEntry.model_construct(
                 step_index=step_number,
                 node_name=current_node_name,
-                state_snapshot=current_state.dict(),
+                state_snapshot=self.snapshot_state(
+                    current_state, graph, publish_queue, snapshot_pool, function_pool
+                ),
                 message=message,
                 error=None,
             )
             run_info.logs.append(log_entry)
             run_info.step_count = step_number + 1
 
-            if publish_queue is not None:
-                await publish_queue.put({"type": "log", "entry": log_entry.dict()})
+            await self.publish_log(publish_queue, log_entry, function_pool)
 
             if next_key is None:
                 run_info.status = RunStatus.COMPLETED
                 run_info.final_state = current_state
-                if publish_queue is not None:
-                    await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+                await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
                 break
 
-            found, next_node_name = self.resolve_next_node(edges_map, current_node_name, next_key)
+            found, next_node_name = self.resolve_destination(destinations, next_key)
             if not found:
                 run_info.status = RunStatus.FAILED
                 run_info.final_state = current_state
-                if publish_queue is not None:
-                    await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+                await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
                 break
 
             if next_node_name is None:
                 run_info.status = RunStatus.COMPLETED
                 run_info.final_state = current_state
-                if publish_queue is not None:
-                    await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+                await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
                 break
 
             current_node_name = next_node_name
@@ -125,39 +201,120 @@ class WorkflowEngine:
         else:
             run_info.status = RunStatus.FAILED
             run_info.final_state = current_state
-            if publish_queue is not None:
-                await publish_queue.put({"type": "completion", "run_info": run_info.dict()})
+            await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
 
-        return run_info
+    async def cancel_run(self, run_identifier: str, publish_queue: Optional[PublishQueue] = None) -> None:
+        run_info = await stored_runs.get(run_identifier)
+        if run_info is None or run_info.status in (RunStatus.COMPLETED, RunStatus.FAILED):
+            return
+        run_info.status = RunStatus.CANCELLED
+        await self.publish(publish_queue, {"type": "completion", "run_info": run_info})
+
+    def snapshot_state(
+        self,
+        state: StateModel,
+        graph: GraphSpec,
+        publish_queue: Optional[PublishQueue],
+        snapshot_pool: Dict[bytes, Any],
+        function_pool: FunctionPool,
+    ) -> Dict[str, Any]:
+        if not graph.log_snapshots and (publish_queue is None or not publish_queue.subscribed):
+            return {}
+        snapshot = state.model_dump()
+        snapshot["functions"] = [
+            self.pool_function_source(entry, function_pool) for entry in snapshot.get("functions") or []
+        ]
+        self.pool_source_code(snapshot, function_pool)
+        for field_name, value in snapshot.items():
+            if isinstance(value, (dict, list)) and value:
+                snapshot[field_name] = self.intern_value(value, snapshot_pool)
+        return snapshot
+
+    def pool_function_source(self, entry: Dict[str, Any], function_pool: FunctionPool) -> Dict[str, Any]:
+        if not isinstance(entry.get("source"), str):
+            return entry
+        pooled = {key: value for key, value in entry.items() if key != "source"}
+        pooled["source_id"] = function_pool.add(entry["source"])
+        return pooled
+
+    def pool_source_code(self, snapshot: Dict[str, Any], function_pool: FunctionPool) -> None:
+        source_code = snapshot.get("source_code")
+        if isinstance(source_code, str):
+            snapshot["source_code_id"] = function_pool.add(source_code)
+        elif isinstance(source_code, dict) and all(isinstance(content, str) for content in source_code.values()):
+            snapshot["source_code_id"] = {
+                filename: function_pool.add(content) for filename, content in source_code.items()
+            }
+        else:
+            return
+        del snapshot["source_code"]
+
+    def intern_value(self, value: Any, snapshot_pool: Dict[bytes, Any]) -> Any:
+        encoded = orjson.dumps(value, default=str, option=orjson.OPT_SORT_KEYS)
+        digest = hashlib.blake2b(encoded, digest_size=16).digest()
+        return snapshot_pool.setdefault(digest, value)
+
+    async def publish_log(
+        self, publish_queue: Optional[PublishQueue], log_entry: LogEntry, function_pool: FunctionPool
+    ) -> None:
+        for source_id, source in function_pool.unpublished():
+            if not await self.publish(publish_queue, {"type": "fn_def", "id": source_id, "src": source}):
+                break
+            function_pool.mark_published(source_id)
+        await self.publish(publish_queue, {"type": "log", "entry": log_entry})
 
-    def build_edges_map(self, graph: GraphSpec) -> Dict[str, Any]:
-        mapping: Dict[str, Any] = {}
+    async def publish(self, publish_queue: Optional[PublishQueue], message: Dict[str, Any]) -> bool:
+        if publish_queue is None or publish_queue.closed:
+            return False
+        if message["type"] != "completion" and not publish_queue.subscribed and publish_queue.maxsize > 0:
+            if publish_queue.qsize() >= publish_queue.maxsize - 2:
+                if publish_queue.dropped_marker is None:
+                    publish_queue.dropped_marker = {"type": "dropped", "count": 0}
+                    publish_queue.put_nowait(publish_queue.dropped_marker)
+                publish_queue.dropped_marker["count"] += 1
+                return False
+        await publish_queue.put(message)
+        return True
+
+    def build_edges_map(self, graph: GraphSpec) -> Dict[str, EdgeDestinations]:
+        mapping: Dict[str, EdgeDestinations] = {}
         for edge in graph.edges:
-            mapping[edge.from_node] = edge.to_node
+            if isinstance(edge.to_node, str):
+                mapping[edge.from_node] = {None: edge.to_node}
+            else:
+                mapping[edge.from_node] = dict(edge.to_node)
         return mapping
 
-    def get_node_config(self, graph: GraphSpec, node_name: str) -> Optional[Dict[str, Any]]:
+    def build_node_config_map(self, graph: GraphSpec) -> Dict[str, Optional[Dict[str, Any]]]:
+        mapping: Dict[str, Optional[Dict[str, Any]]] = {}
         for node in graph.nodes:
-            if node.name == node_name:
-                return node.config
-        return None
-
-    def resolve_next_node(
-        self, edges_map: Dict[str, Any], current_node_name: str, next_key: Optional[str]
-    ) -> Tuple[bool, Optional[str]]:
-        if current_node_name not in edges_map:
-            return False, None
+            mapping.setdefault(node.name, node.config)
+        return mapping
 
-        destination = edges_map[current_node_name]
+    def get_node_config(self, graph_identifier: str, node_name: str) -> Optional[Dict[str, Any]]:
+        return stored_graph_node_configs[graph_identifier].get(node_name)
 
-        if isinstance(destination, str):
-            return True, destination
+    def get_plan_step(self, graph_identifier: str, node_name: str) -> Optional[PlanStep]:
+        plan = stored_graph_plans[graph_identifier]
+        plan_step = plan.get(node_name)
+        if plan_step is None and node_name in NODE_FUNCTIONS:
+            plan_step = (
+                NODE_FUNCTIONS[node_name],
+                self.get_node_config(graph_identifier, node_name),
+                stored_graph_edges[graph_identifier].get(node_name),
+            )
+            plan[node_name] = plan_step
+        return plan_step
 
-        if isinstance(destination, dict):
-            if next_key in destination:
-                return True, destination.get(next_key)
+    def resolve_destination(
+        self, destinations: Optional[EdgeDestinations], next_key: Optional[str]
+    ) -> Tuple[bool, Optional[str]]:
+        if destinations is None:
             return False, None
-
+        if next_key in destinations:
+            return True, destinations[next_key]
+        if None in destinations:
+            return True, destinations[None]
         return False, None
 
 
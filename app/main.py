@@ -1,16 +1,42 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
+import orjson
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 
 from app.schemas import GraphSpec, CreateGraphResponse, RunRequest, RunInfo
-from app.engine import workflow_engine, stored_graphs, stored_runs, stored_run_queues
+from app.engine import PublishQueue, workflow_engine, stored_graphs, stored_runs, stored_run_queues
 
 app = FastAPI(title="Workflow Engine")
 
+run_semaphore = asyncio.Semaphore(32)
+stored_run_tasks: Dict[str, asyncio.Task] = {}
+
+
+def encode_model(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_message(message: Any) -> str:
+    return orjson.dumps(message, default=encode_model).decode()
+
+
+async def execute_run(run_identifier: str, publish_queue: PublishQueue) -> None:
+    try:
+        async with run_semaphore:
+            await workflow_engine.run_workflow(run_identifier, publish_queue=publish_queue)
+    except asyncio.CancelledError:
+        await workflow_engine.cancel_run(run_identifier, publish_queue)
+        raise
+    finally:
+        stored_run_tasks.pop(run_identifier, None)
+
 
 @app.post("/graph/create", response_model=CreateGraphResponse)
 def create_graph(graph_specification: GraphSpec):
@@ -22,38 +48,51 @@ def create_graph(graph_specification: GraphSpec):
 async def run_graph(request: RunRequest):
     if request.graph_id not in stored_graphs:
         raise HTTPException(status_code=404, detail="Graph not found")
-    run_identifier = workflow_engine.create_run(request.graph_id, request.initial_state)
-    publish_queue: asyncio.Queue = asyncio.Queue()
-    stored_run_queues[run_identifier] = publish_queue
-    asyncio.create_task(workflow_engine.run_workflow(run_identifier, publish_queue=publish_queue))
+    run_identifier = await workflow_engine.create_run(request.graph_id, request.initial_state)
+    publish_queue = PublishQueue(maxsize=stored_graphs[request.graph_id].max_queue)
+    await stored_run_queues.set(run_identifier, publish_queue)
+    stored_run_tasks[run_identifier] = asyncio.create_task(execute_run(run_identifier, publish_queue))
+    return JSONResponse({"run_id": run_identifier})
+
+
+@app.post("/graph/cancel/{run_identifier}")
+async def cancel_run(run_identifier: str):
+    run_task = stored_run_tasks.get(run_identifier)
+    if run_task is None:
+        raise HTTPException(status_code=404, detail="Run not found or already finished")
+    run_task.cancel()
     return JSONResponse({"run_id": run_identifier})
 
 
 @app.get("/graph/state/{run_identifier}", response_model=RunInfo)
-def get_run_state(run_identifier: str):
-    if run_identifier not in stored_runs:
+async def get_run_state(run_identifier: str):
+    run_info = await stored_runs.get(run_identifier)
+    if run_info is None:
         raise HTTPException(status_code=404, detail="Run not found")
-    return stored_runs[run_identifier]
+    return run_info
 
 
 @app.websocket("/graph/ws/{run_identifier}")
 async def websocket_run_stream(websocket: WebSocket, run_identifier: str):
     await websocket.accept()
-    if run_identifier not in stored_run_queues:
+    publish_queue: Optional[PublishQueue] = await stored_run_queues.get(run_identifier)
+    if publish_queue is None:
         await websocket.close(code=1008)
         return
-    publish_queue: asyncio.Queue = stored_run_queues[run_identifier]
+    publish_queue.attach()
     try:
         while True:
-            message = await publish_queue.get()
-            await websocket.send_json(message)
-            if isinstance(message, dict) and message.get("type") == "completion":
+            batch = [await publish_queue.get()]
+            while True:
+                try:
+                    batch.append(publish_queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            await websocket.send_text(dump_message(batch))
+            if any(isinstance(message, dict) and message.get("type") == "completion" for message in batch):
                 break
     except WebSocketDisconnect:
         return
     finally:
-        if run_identifier in stored_run_queues:
-            try:
-                del stored_run_queues[run_identifier]
-            except KeyError:
-                pass
+        publish_queue.detach()
+        await stored_run_queues.pop(run_identifier)
@@ -3,7 +3,10 @@ from __future__ import annotations
 import asyncio
 import logging
 import math
-from typing import Any, Callable, Dict, Optional, Tuple
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from app.schemas import StateModel
 
@@ -20,69 +23,189 @@ if not logger.handlers:
 ToolType = Callable[..., Any]
 registered_tools: Dict[str, ToolType] = {}
 
+tool_thread_pool = ThreadPoolExecutor(thread_name_prefix="workflow-tools")
+tool_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def apply_tool_batch(tool: ToolType, sources: List[str]) -> List[Tuple[bool, Any]]:
+    outcomes = []
+    for source in sources:
+        try:
+            outcomes.append((True, tool(source)))
+        except Exception as tool_error:
+            outcomes.append((False, tool_error))
+    return outcomes
+
+
+class ToolBatcher:
+    def __init__(self, tool: ToolType, max_batch: int = 32, max_wait_ms: float = 5.0) -> None:
+        self.tool = tool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.Handle] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.in_flight = 0
+
+    async def __call__(self, source: str) -> Any:
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.pending = []
+            self.flush_handle = None
+            self.in_flight = 0
+        future = loop.create_future()
+        self.pending.append((source, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None and self.in_flight == 0:
+            self.flush_handle = loop.call_soon(self.flush)
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch = [(source, future) for source, future in self.pending if not future.done()]
+        self.pending = []
+        if not batch:
+            return
+        self.in_flight += 1
+        loop = asyncio.get_running_loop()
+        sources = [source for source, _ in batch]
+        execution = loop.run_in_executor(tool_thread_pool, apply_tool_batch, self.tool, sources)
+        execution.add_done_callback(lambda done: self.resolve(batch, done))
+
+    def resolve(self, batch: List[Tuple[str, asyncio.Future]], done: asyncio.Future) -> None:
+        self.in_flight -= 1
+        if done.cancelled() or done.exception() is not None:
+            for _, future in batch:
+                if not future.done():
+                    if done.cancelled():
+                        future.cancel()
+                    else:
+                        future.set_exception(done.exception())
+            return
+        for (_, future), (succeeded, value) in zip(batch, done.result()):
+            if future.done():
+                continue
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+tool_batchers: Dict[str, ToolBatcher] = {}
+
 
 def register_tool(name: str, tool: ToolType) -> None:
     registered_tools[name] = tool
+    tool_batchers[name] = ToolBatcher(tool)
 
 
 def get_tool(name: str) -> ToolType:
     return registered_tools[name]
 
 
+def get_tool_executor(config: Optional[Dict[str, Any]] = None) -> Executor:
+    global tool_process_pool
+    if config and config.get("use_process_pool"):
+        if tool_process_pool is None:
+            tool_process_pool = ProcessPoolExecutor()
+        return tool_process_pool
+    return tool_thread_pool
+
+
+async def map_tool(
+    tools: Dict[str, ToolType],
+    name: str,
+    sources: List[str],
+    config: Optional[Dict[str, Any]] = None,
+) -> List[Any]:
+    tool = tools[name]
+    batcher = tool_batchers.get(name)
+    if batcher is not None and batcher.tool is tool and not (config and config.get("use_process_pool")):
+        return await asyncio.gather(*(batcher(source) for source in sources))
+
+    loop = asyncio.get_running_loop()
+    executor = get_tool_executor(config)
+    return await asyncio.gather(*(loop.run_in_executor(executor, tool, source) for source in sources))
+
+
+COMPLEXITY_PATTERN = re.compile(
+    r"\b(?:if|for|while|elif|case|except|and|or|return)\b", re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=4096)
 def estimate_complexity(function_source: str) -> int:
     if not function_source:
         return 0
-    keywords = ["if ", "for ", "while ", "elif ", "case ", "except ", "and ", "or ", "return "]
-    score = 1
-    lower_source = function_source.lower()
-    for keyword in keywords:
-        score += lower_source.count(keyword)
+    score = 1 + len(COMPLEXITY_PATTERN.findall(function_source))
     return max(1, min(score, 100))
 
 
-def run_lint(function_source: str) -> Dict[str, Any]:
-    issues = []
-    lines = function_source.splitlines()
+LintIssue = Tuple[str, int, str]
+
+DEF_WITH_BODY_PATTERN = re.compile(r"^[^\S\n]*def [^\S\n]*\S[^\n]*((?:\n[^\n]*){0,3})", re.MULTILINE)
+LINT_LINE_PATTERN = re.compile(r"^(?=[^\n]{121}|[^\n]*[^\S\n]$)[^\n]*", re.MULTILINE)
+
+
+LINE_BREAK_PATTERN = re.compile(r"\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+FUNCTION_DEF_PATTERN = re.compile(r"^[^\S\n]*def[ \t]+([^\W\d]\w*)", re.MULTILINE)
+
 
-    for line_number, line_text in enumerate(lines, start=1):
+def normalize_newlines(text: str) -> str:
+    return LINE_BREAK_PATTERN.sub("\n", text)
+
+
+def match_line_numbers(text: str, matches: List[re.Match]) -> List[int]:
+    line_numbers = []
+    line_number = 1
+    position = 0
+    for match in matches:
+        line_number += text.count("\n", position, match.start())
+        position = match.start()
+        line_numbers.append(line_number)
+    return line_numbers
+
+
+@lru_cache(maxsize=4096)
+def lint_source(function_source: str) -> Tuple[LintIssue, ...]:
+    function_source = normalize_newlines(function_source)
+    matches = list(LINT_LINE_PATTERN.finditer(function_source))
+
+    issues = []
+    for match, line_number in zip(matches, match_line_numbers(function_source, matches)):
+        line_text = match.group()
         if len(line_text) > 120:
-            issues.append(
-                {
-                    "type": "long_line",
-                    "line": line_number,
-                    "detail": "Line longer than 120 characters",
-                }
-            )
-        if line_text.rstrip() != line_text:
-            issues.append(
-                {
-                    "type": "trailing_whitespace",
-                    "line": line_number,
-                    "detail": "Line contains trailing whitespace",
-                }
-            )
+            issues.append(("long_line", line_number, "Line longer than 120 characters"))
+        if line_text[-1].isspace():
+            issues.append(("trailing_whitespace", line_number, "Line contains trailing whitespace"))
+
+    def_match = DEF_WITH_BODY_PATTERN.search(function_source)
+    if def_match is not None:
+        next_lines = def_match.group(1).split("\n")[1:]
+        has_docstring = any(item.strip().startswith(('"""', "'''")) for item in next_lines)
+        if not has_docstring:
+            line_number = function_source.count("\n", 0, def_match.start()) + 1
+            issues.append(("missing_docstring", line_number, "Function may be missing a docstring"))
+
+    return tuple(issues)
 
-    for index, content in enumerate(lines):
-        stripped = content.strip()
-        if stripped.startswith("def "):
-            next_lines = lines[index + 1 : index + 4]
-            has_docstring = any(item.strip().startswith(('"""', "'''")) for item in next_lines)
-            if not has_docstring:
-                issues.append(
-                    {
-                        "type": "missing_docstring",
-                        "line": index + 1,
-                        "detail": "Function may be missing a docstring",
-                    }
-                )
-            break
 
+def run_lint(function_source: str) -> Dict[str, Any]:
+    issues = [
+        {"type": issue_type, "line": line_number, "detail": detail}
+        for issue_type, line_number, detail in lint_source(function_source)
+    ]
     return {"issue_count": len(issues), "issues": issues}
 
 
-def generate_suggestions(function_source: str) -> Dict[str, Any]:
+def build_suggestions(complexity: int, lint_issues: Tuple[LintIssue, ...]) -> List[Dict[str, Any]]:
     suggestions = []
-    complexity = estimate_complexity(function_source)
     if complexity > 10:
         suggestions.append(
             {
@@ -90,28 +213,73 @@ def generate_suggestions(function_source: str) -> Dict[str, Any]:
                 "detail": "Function appears complex and could be split into smaller parts",
             }
         )
-    lint_result = run_lint(function_source)
-    for issue in lint_result["issues"]:
-        if issue["type"] == "long_line":
+    for issue_type, line_number, _ in lint_issues:
+        if issue_type == "long_line":
             suggestions.append(
                 {
                     "type": "wrap_long_line",
-                    "detail": f"Consider wrapping line {issue['line']}",
+                    "detail": f"Consider wrapping line {line_number}",
                 }
             )
-        if issue["type"] == "missing_docstring":
+        if issue_type == "missing_docstring":
             suggestions.append(
                 {
                     "type": "add_docstring",
                     "detail": "Add a descriptive docstring",
                 }
             )
-    return {"suggestions": suggestions}
+    return suggestions
+
+
+def generate_suggestions(function_source: str) -> Dict[str, Any]:
+    complexity = estimate_complexity(function_source)
+    return {"suggestions": build_suggestions(complexity, lint_source(function_source))}
+
+
+def fused_analyze(function_source: str) -> Dict[str, Any]:
+    complexity = estimate_complexity(function_source)
+    lint_issues = lint_source(function_source)
+    return {
+        "complexity": complexity,
+        "lint_issues": [
+            {"type": issue_type, "line": line_number, "detail": detail}
+            for issue_type, line_number, detail in lint_issues
+        ],
+        "suggestions": build_suggestions(complexity, lint_issues),
+    }
 
 
 register_tool("estimate_complexity", estimate_complexity)
 register_tool("run_lint", run_lint)
 register_tool("generate_suggestions", generate_suggestions)
+register_tool("fused_analyze", fused_analyze)
+
+
+def complexity_quality(results: List[Dict[str, Any]]) -> float:
+    if results:
+        average = sum(item["complexity"] for item in results) / len(results)
+        return max(0.0, 100.0 - average)
+    return 100.0
+
+
+def apply_suggestion_bonus(state: StateModel, suggestions: List[Dict[str, Any]]) -> None:
+    count = sum(len(s["suggestions"]) for s in suggestions)
+    if count > 0:
+        state.quality_score = min(100.0, (state.quality_score or 0.0) + math.log1p(count) * 2.0)
+    else:
+        state.quality_score = min(100.0, (state.quality_score or 0.0) + 1.0)
+
+
+def ensure_function_columns(state: StateModel) -> None:
+    functions = state.functions or []
+    count = len(functions)
+    if len(state.function_names) == len(state.function_sources) == len(state.function_spans) == count:
+        return
+    state.function_names = [entry["function_name"] for entry in functions]
+    state.function_sources = [entry.get("source", "") for entry in functions]
+    state.function_spans = [
+        (entry.get("filename", ""), entry.get("start_line", 0), entry.get("end_line", 0)) for entry in functions
+    ]
 
 
 async def extract_functions_node(
@@ -121,6 +289,9 @@ async def extract_functions_node(
 ) -> Tuple[Optional[str], StateModel, str]:
     source = state.source_code
     extracted = []
+    function_names = []
+    function_sources = []
+    function_spans = []
 
     if isinstance(source, str):
         file_map = {"main.py": source}
@@ -128,44 +299,38 @@ async def extract_functions_node(
         file_map = source or {}
 
     for filename, content in file_map.items():
-        lines = content.splitlines()
-        current_source = []
-        current_name = None
-        start_line = 0
-
-        for line_number, line_text in enumerate(lines, start=1):
-            stripped = line_text.lstrip()
-
-            if stripped.startswith("def "):
-                if current_name is not None:
-                    extracted.append(
-                        {
-                            "filename": filename,
-                            "function_name": current_name,
-                            "start_line": start_line,
-                            "end_line": line_number - 1,
-                            "source": "\n".join(current_source),
-                        }
-                    )
-                current_name = stripped.split("(")[0].replace("def ", "").strip()
-                start_line = line_number
-                current_source = [line_text]
+        content = normalize_newlines(content)
+        matches = list(FUNCTION_DEF_PATTERN.finditer(content))
+        start_lines = match_line_numbers(content, matches)
+        total_lines = content.count("\n") + (0 if not content or content.endswith("\n") else 1)
+        content_end = len(content) - 1 if content.endswith("\n") else len(content)
+
+        for index, match in enumerate(matches):
+            if index + 1 < len(matches):
+                end_line = start_lines[index + 1] - 1
+                source_end = matches[index + 1].start() - 1
             else:
-                if current_name is not None:
-                    current_source.append(line_text)
-
-        if current_name is not None:
+                end_line = total_lines
+                source_end = content_end
+            function_name = match.group(1)
+            function_source = content[match.start() : source_end]
+            function_names.append(function_name)
+            function_sources.append(function_source)
+            function_spans.append((filename, start_lines[index], end_line))
             extracted.append(
                 {
                     "filename": filename,
-                    "function_name": current_name,
-                    "start_line": start_line,
-                    "end_line": len(lines),
-                    "source": "\n".join(current_source),
+                    "function_name": function_name,
+                    "start_line": start_lines[index],
+                    "end_line": end_line,
+                    "source": function_source,
                 }
             )
 
     state.functions = extracted
+    state.function_names = function_names
+    state.function_sources = function_sources
+    state.function_spans = function_spans
     return "check_complexity", state, f"extracted {len(extracted)} functions"
 
 
@@ -174,27 +339,20 @@ async def check_complexity_node(
     tools: Dict[str, ToolType],
     config: Optional[Dict[str, Any]] = None,
 ) -> Tuple[Optional[str], StateModel, str]:
-    tool = tools["estimate_complexity"]
+    ensure_function_columns(state)
+    complexities = await map_tool(tools, "estimate_complexity", state.function_sources, config)
     results = []
 
-    for function_entry in state.functions:
-        source = function_entry.get("source", "")
-        complexity = await asyncio.to_thread(tool, source)
+    for function_name, complexity in zip(state.function_names, complexities):
         results.append(
             {
-                "function_name": function_entry["function_name"],
+                "function_name": function_name,
                 "complexity": complexity,
             }
         )
 
-    if results:
-        average = sum(item["complexity"] for item in results) / len(results)
-        quality = max(0.0, 100.0 - average)
-    else:
-        quality = 100.0
-
     state.metadata["complexity"] = results
-    state.quality_score = quality
+    state.quality_score = complexity_quality(results)
 
     return "detect_issues", state, f"computed complexity for {len(results)} functions"
 
@@ -204,16 +362,15 @@ async def detect_issues_node(
     tools: Dict[str, ToolType],
     config: Optional[Dict[str,Any]] = None,
 ) -> Tuple[Optional[str], StateModel, str]:
-    tool = tools["run_lint"]
+    ensure_function_columns(state)
+    lint_results = await map_tool(tools, "run_lint", state.function_sources, config)
     collected = []
 
-    for item in state.functions:
-        source = item.get("source", "")
-        result = await asyncio.to_thread(tool, source)
+    for function_name, result in zip(state.function_names, lint_results):
         if result["issue_count"] > 0:
             collected.append(
                 {
-                    "function_name": item["function_name"],
+                    "function_name": function_name,
                     "issues": result["issues"],
                 }
             )
@@ -227,30 +384,59 @@ async def suggest_improvements_node(
     tools: Dict[str, ToolType],
     config: Optional[Dict[str,Any]] = None,
 ) -> Tuple[Optional[str], StateModel, str]:
-    tool = tools["generate_suggestions"]
+    ensure_function_columns(state)
+    suggestion_results = await map_tool(tools, "generate_suggestions", state.function_sources, config)
     suggestions = []
 
-    for item in state.functions:
-        source = item.get("source", "")
-        result = await asyncio.to_thread(tool, source)
+    for function_name, result in zip(state.function_names, suggestion_results):
         suggestions.append(
             {
-                "function_name": item["function_name"],
+                "function_name": function_name,
                 "suggestions": result["suggestions"],
             }
         )
 
     state.suggestions = suggestions
-
-    count = sum(len(s["suggestions"]) for s in suggestions)
-    if count > 0:
-        state.quality_score = min(100.0, (state.quality_score or 0.0) + math.log1p(count) * 2.0)
-    else:
-        state.quality_score = min(100.0, (state.quality_score or 0.0) + 1.0)
+    apply_suggestion_bonus(state, suggestions)
 
     return "compute_quality", state, f"generated suggestions for {len(suggestions)} functions"
 
 
+async def analyze_node(
+    state: StateModel,
+    tools: Dict[str, ToolType],
+    config: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[str], StateModel, str]:
+    config = config or {}
+    ensure_function_columns(state)
+    analyses = await map_tool(tools, "fused_analyze", state.function_sources, config)
+
+    if config.get("complexity", True):
+        results = [
+            {"function_name": function_name, "complexity": analysis["complexity"]}
+            for function_name, analysis in zip(state.function_names, analyses)
+        ]
+        state.metadata["complexity"] = results
+        state.quality_score = complexity_quality(results)
+
+    if config.get("issues", True):
+        state.issues = [
+            {"function_name": function_name, "issues": analysis["lint_issues"]}
+            for function_name, analysis in zip(state.function_names, analyses)
+            if analysis["lint_issues"]
+        ]
+
+    if config.get("suggestions", True):
+        suggestions = [
+            {"function_name": function_name, "suggestions": analysis["suggestions"]}
+            for function_name, analysis in zip(state.function_names, analyses)
+        ]
+        state.suggestions = suggestions
+        apply_suggestion_bonus(state, suggestions)
+
+    return "compute_quality", state, f"analyzed {len(analyses)} functions"
+
+
 async def compute_quality_node(
     state: StateModel,
     tools: Dict[str, ToolType],
@@ -271,5 +457,6 @@ NODE_FUNCTIONS: Dict[str, Callable[..., Any]] = {
     "check_complexity": check_complexity_node,
     "detect_issues": detect_issues_node,
     "suggest_improvements": suggest_improvements_node,
+    "analyze": analyze_node,
     "compute_quality": compute_quality_node,
 }
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import BaseModel, Field
 
@@ -21,6 +21,17 @@ class StateModel(BaseModel):
     functions: Optional[List[Dict[str, Any]]] = Field(
         default_factory=list, description="Extracted functions and metadata"
     )
+    function_names: List[str] = Field(
+        default_factory=list, description="Names of extracted functions, parallel to function_sources"
+    )
+    function_sources: List[str] = Field(
+        default_factory=list,
+        exclude=True,
+        description="Source text of extracted functions, parallel to function_names; not serialized",
+    )
+    function_spans: List[Tuple[str, int, int]] = Field(
+        default_factory=list, description="Filename, start line and end line of each extracted function"
+    )
     quality_score: Optional[float] = Field(
         default=None, description="Numeric quality score used for loop decisions"
     )
@@ -55,6 +66,10 @@ class GraphSpec(BaseModel):
     edges: List[EdgeSpec] = Field(default_factory=list, description="List of edges")
     start_node: str = Field(..., description="Entry point node name")
     max_iterations: int = Field(default=100, description="Maximum node executions per run")
+    max_queue: int = Field(default=64, ge=2, description="Maximum buffered stream messages per run")
+    log_snapshots: bool = Field(
+        default=False, description="Record state snapshots in logs even when no stream is attached"
+    )
 
 
 class CreateGraphResponse(BaseModel):
@@ -82,6 +97,9 @@ class RunInfo(BaseModel):
     step_count: int = Field(default=0, description="Number of executed steps so far")
     logs: List[LogEntry] = Field(default_factory=list, description="Execution log entries")
     final_state: Optional[StateModel] = Field(default=None, description="Final state when run completes")
+    source_pool: Dict[str, str] = Field(
+        default_factory=dict, description="Function sources referenced by id from log state snapshots"
+    )
 
 
 class RunResponse(BaseModel):
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Dict, Generic, List, Optional, TypeVar
+
+ValueType = TypeVar("ValueType")
+
+
+class RunStore(Generic[ValueType]):
+    def __init__(self, shard_count: int = 16) -> None:
+        self.shards: List[Dict[str, ValueType]] = [{} for _ in range(shard_count)]
+        self.locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(shard_count)]
+
+    def shard_index(self, key: str) -> int:
+        return hash(key) % len(self.shards)
+
+    async def get(self, key: str) -> Optional[ValueType]:
+        index = self.shard_index(key)
+        async with self.locks[index]:
+            return self.shards[index].get(key)
+
+    async def set(self, key: str, value: ValueType) -> None:
+        index = self.shard_index(key)
+        async with self.locks[index]:
+            self.shards[index][key] = value
+
+    async def pop(self, key: str) -> Optional[ValueType]:
+        index = self.shard_index(key)
+        async with self.locks[index]:
+            return self.shards[index].pop(key, None)
@@ -0,0 +1,147 @@
+import asyncio
+
+from app.engine import FunctionPool, PublishQueue, workflow_engine
+from app.schemas import GraphSpec, RunStatus, StateModel
+
+
+def run_graph(graph, state, subscribed=True):
+    async def scenario():
+        graph_identifier = workflow_engine.create_graph(graph)
+        run_identifier = await workflow_engine.create_run(graph_identifier, state)
+        publish_queue = PublishQueue(maxsize=graph.max_queue)
+        if subscribed:
+            publish_queue.attach()
+        run_info = await workflow_engine.run_workflow(run_identifier, publish_queue=publish_queue)
+        messages = []
+        while not publish_queue.empty():
+            messages.append(publish_queue.get_nowait())
+        return run_info, messages
+
+    return asyncio.run(scenario())
+
+
+def complexity_graph():
+    return GraphSpec(nodes=[{"name": "check_complexity"}], start_node="check_complexity", edges=[])
+
+
+def test_non_string_function_source_is_not_pooled():
+    state = StateModel(functions=[{"function_name": "f", "source": None}])
+    run_info, messages = run_graph(complexity_graph(), state)
+    assert run_info.step_count == 1
+    assert run_info.logs[0].state_snapshot["functions"] == [{"function_name": "f", "source": None}]
+    assert messages[-1]["type"] == "completion"
+
+
+def test_snapshot_failure_fails_run_and_publishes_completion(monkeypatch):
+    def broken_snapshot(*args, **kwargs):
+        raise ValueError("snapshot failed")
+
+    monkeypatch.setattr(workflow_engine, "snapshot_state", broken_snapshot)
+    run_info, messages = run_graph(complexity_graph(), StateModel())
+    assert run_info.status == RunStatus.FAILED
+    assert run_info.logs[-1].error == "snapshot failed"
+    assert [message["type"] for message in messages] == ["log", "completion"]
+
+
+def test_snapshots_are_skipped_until_a_subscriber_attaches():
+    state = StateModel(functions=[{"function_name": "f", "source": "def f():\n    pass"}])
+    run_info, _ = run_graph(complexity_graph(), state, subscribed=False)
+    assert run_info.logs[0].state_snapshot == {}
+
+    run_info, _ = run_graph(complexity_graph(), state.model_copy(deep=True), subscribed=True)
+    assert run_info.logs[0].state_snapshot["quality_score"] == 99.0
+
+
+def test_log_snapshots_flag_records_snapshots_without_a_subscriber():
+    graph = complexity_graph().model_copy(update={"log_snapshots": True})
+    run_info, _ = run_graph(graph, StateModel(), subscribed=False)
+    assert run_info.logs[0].state_snapshot["quality_score"] == 100.0
+
+
+def test_snapshots_reference_source_code_by_id():
+    source = "def f():\n    pass"
+    run_info, messages = run_graph(complexity_graph(), StateModel(source_code={"a.py": source}))
+    snapshot = run_info.logs[0].state_snapshot
+    assert "source_code" not in snapshot
+    assert run_info.source_pool[snapshot["source_code_id"]["a.py"]] == source
+    assert [message["type"] for message in messages[:2]] == ["fn_def", "log"]
+
+
+def test_fn_def_dropped_before_subscribing_is_sent_later():
+    async def scenario():
+        graph = complexity_graph()
+        graph_identifier = workflow_engine.create_graph(graph)
+        run_identifier = await workflow_engine.create_run(graph_identifier, StateModel(source_code="x = 1"))
+        run_info = await workflow_engine.run_workflow(run_identifier)
+        function_pool = FunctionPool(run_info.source_pool)
+        source_id = function_pool.add("x = 1")
+        publish_queue = PublishQueue(maxsize=2)
+        await workflow_engine.publish_log(publish_queue, run_info.logs[0], function_pool)
+        dropped = [publish_queue.get_nowait() for _ in range(publish_queue.qsize())]
+        publish_queue.attach()
+        await workflow_engine.publish_log(publish_queue, run_info.logs[0], function_pool)
+        resent = publish_queue.get_nowait()
+        return source_id, dropped, resent
+
+    source_id, dropped, resent = asyncio.run(scenario())
+    assert dropped == [{"type": "dropped", "count": 2}]
+    assert resent == {"type": "fn_def", "id": source_id, "src": "x = 1"}
+
+
+def log_message(index):
+    return {"type": "log", "entry": index}
+
+
+def test_unsubscribed_queue_coalesces_dropped_messages_and_keeps_room_for_completion():
+    async def scenario():
+        publish_queue = PublishQueue(maxsize=4)
+        queued = [await workflow_engine.publish(publish_queue, log_message(index)) for index in range(5)]
+        await workflow_engine.publish(publish_queue, {"type": "completion"})
+        messages = []
+        while not publish_queue.empty():
+            messages.append(publish_queue.get_nowait())
+        return queued, messages
+
+    queued, messages = asyncio.run(scenario())
+    assert queued == [True, True, False, False, False]
+    assert messages == [
+        log_message(0),
+        log_message(1),
+        {"type": "dropped", "count": 3},
+        {"type": "completion"},
+    ]
+
+
+def test_subscribed_queue_applies_backpressure_instead_of_dropping():
+    async def scenario():
+        publish_queue = PublishQueue(maxsize=2)
+        publish_queue.attach()
+        producer = asyncio.ensure_future(
+            asyncio.gather(*(workflow_engine.publish(publish_queue, log_message(index)) for index in range(4)))
+        )
+        await asyncio.sleep(0.01)
+        blocked = not producer.done()
+        received = []
+        while len(received) < 4:
+            received.append(await publish_queue.get())
+        return blocked, await producer, received
+
+    blocked, queued, received = asyncio.run(scenario())
+    assert blocked
+    assert queued == [True, True, True, True]
+    assert received == [log_message(index) for index in range(4)]
+
+
+def test_detach_releases_a_blocked_publisher():
+    async def scenario():
+        publish_queue = PublishQueue(maxsize=2)
+        publish_queue.attach()
+        await workflow_engine.publish(publish_queue, log_message(0))
+        await workflow_engine.publish(publish_queue, log_message(1))
+        producer = asyncio.ensure_future(workflow_engine.publish(publish_queue, log_message(2)))
+        await asyncio.sleep(0.01)
+        publish_queue.detach()
+        await asyncio.wait_for(producer, timeout=1.0)
+        return await workflow_engine.publish(publish_queue, {"type": "completion"})
+
+    assert asyncio.run(scenario()) is False
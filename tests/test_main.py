@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from app import main, nodes_tools
+from app.engine import PublishQueue, stored_runs, workflow_engine
+from app.schemas import GraphSpec, RunStatus, StateModel
+
+
+async def slow_node(state, tools, config):
+    await asyncio.sleep(10)
+    return None, state, "done"
+
+
+def drain(publish_queue):
+    messages = []
+    while not publish_queue.empty():
+        messages.append(publish_queue.get_nowait())
+    return messages
+
+
+def cancel_run_scenario(hold_semaphore):
+    async def scenario():
+        graph_identifier = workflow_engine.create_graph(
+            GraphSpec(nodes=[{"name": "slow"}], start_node="slow", edges=[])
+        )
+        run_identifier = await workflow_engine.create_run(graph_identifier, StateModel())
+        publish_queue = PublishQueue(maxsize=8)
+        publish_queue.attach()
+        if hold_semaphore:
+            await main.run_semaphore.acquire()
+        run_task = asyncio.create_task(main.execute_run(run_identifier, publish_queue))
+        main.stored_run_tasks[run_identifier] = run_task
+        await asyncio.sleep(0.05)
+        run_task.cancel()
+        try:
+            await run_task
+        except asyncio.CancelledError:
+            pass
+        run_info = await stored_runs.get(run_identifier)
+        return run_identifier, run_info, drain(publish_queue)
+
+    return asyncio.run(scenario())
+
+
+def test_cancel_run_mid_step(monkeypatch):
+    monkeypatch.setitem(nodes_tools.NODE_FUNCTIONS, "slow", slow_node)
+    run_identifier, run_info, messages = cancel_run_scenario(hold_semaphore=False)
+    assert run_info.status == RunStatus.CANCELLED
+    assert [message["type"] for message in messages] == ["completion"]
+    assert run_identifier not in main.stored_run_tasks
+
+
+def test_cancel_run_waiting_on_semaphore(monkeypatch):
+    monkeypatch.setitem(nodes_tools.NODE_FUNCTIONS, "slow", slow_node)
+    monkeypatch.setattr(main, "run_semaphore", asyncio.Semaphore(1))
+    run_identifier, run_info, messages = cancel_run_scenario(hold_semaphore=True)
+    assert run_info.status == RunStatus.CANCELLED
+    assert run_info.step_count == 0
+    assert [message["type"] for message in messages] == ["completion"]
+    assert run_identifier not in main.stored_run_tasks
+
+
+def test_cancel_finished_run_returns_404():
+    with TestClient(main.app) as client:
+        graph = {"nodes": [{"name": "check_complexity"}], "start_node": "check_complexity", "edges": []}
+        graph_identifier = client.post("/graph/create", json=graph).json()["graph_id"]
+        run_identifier = client.post("/graph/run", json={"graph_id": graph_identifier}).json()["run_id"]
+        deadline = time.monotonic() + 5
+        while run_identifier in main.stored_run_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.get(f"/graph/state/{run_identifier}").json()["status"] in ("COMPLETED", "FAILED")
+        response = client.post(f"/graph/cancel/{run_identifier}")
+    assert response.status_code == 404
@@ -0,0 +1,223 @@
+import asyncio
+import time
+
+import pytest
+
+from app import nodes_tools
+from app.nodes_tools import (
+    ToolBatcher,
+    check_complexity_node,
+    extract_functions_node,
+    lint_source,
+    map_tool,
+    registered_tools,
+    run_lint,
+)
+from app.schemas import StateModel
+
+FORM_FEED_SOURCE = "def a():\n    pass\n\x0c\ndef b():\n    pass\n"
+
+LINE_BREAKS = ["\n", "\r\n", "\r", "\x0b", "\x0c", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029"]
+
+
+def splitlines_lint(function_source):
+    issues = []
+    lines = function_source.splitlines()
+    for line_number, line_text in enumerate(lines, start=1):
+        if len(line_text) > 120:
+            issues.append(("long_line", line_number))
+        if line_text.rstrip() != line_text:
+            issues.append(("trailing_whitespace", line_number))
+    for index, content in enumerate(lines):
+        if content.strip().startswith("def "):
+            next_lines = lines[index + 1 : index + 4]
+            if not any(item.strip().startswith(('"""', "'''")) for item in next_lines):
+                issues.append(("missing_docstring", index + 1))
+            break
+    return issues
+
+
+def test_form_feed_page_break_keeps_line_numbers():
+    assert run_lint(FORM_FEED_SOURCE)["issues"] == [
+        {"type": "missing_docstring", "line": 1, "detail": "Function may be missing a docstring"}
+    ]
+
+
+@pytest.mark.parametrize("line_break", LINE_BREAKS)
+def test_lint_matches_splitlines_for_every_line_break(line_break):
+    source = line_break.join(
+        [
+            "x = 1",
+            "def f(a):   ",
+            "    return " + "a" * 130,
+            "",
+            "    pass\t",
+            '    """late docstring"""',
+        ]
+    )
+    issues = [(issue_type, line_number) for issue_type, line_number, _ in lint_source(source)]
+    assert issues == splitlines_lint(source)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        "def f():\n    '''doc'''\n",
+        "def f():\n\n\n\n    '''too late'''",
+        "   \n\t\n",
+        "a" * 121 + " \n" + "b" * 120,
+        "def \ndef g():\n    pass",
+        "line\u3000\nother",
+    ],
+)
+def test_lint_matches_splitlines_edge_cases(source):
+    issues = [(issue_type, line_number) for issue_type, line_number, _ in lint_source(source)]
+    assert issues == splitlines_lint(source)
+
+
+def splitlines_extract(content):
+    extracted = []
+    current_source = []
+    current_name = None
+    start_line = 0
+    lines = content.splitlines()
+    for line_number, line_text in enumerate(lines, start=1):
+        stripped = line_text.lstrip()
+        if stripped.startswith("def "):
+            if current_name is not None:
+                extracted.append((current_name, start_line, line_number - 1, "\n".join(current_source)))
+            current_name = stripped.split("(")[0].replace("def ", "").strip()
+            start_line = line_number
+            current_source = [line_text]
+        elif current_name is not None:
+            current_source.append(line_text)
+    if current_name is not None:
+        extracted.append((current_name, start_line, len(lines), "\n".join(current_source)))
+    return extracted
+
+
+def extract(source):
+    _, state, _ = asyncio.run(extract_functions_node(StateModel(source_code=source), registered_tools))
+    return [
+        (entry["function_name"], entry["start_line"], entry["end_line"], entry["source"])
+        for entry in state.functions
+    ]
+
+
+def test_form_feed_page_break_keeps_function_spans():
+    assert [(name, start, end) for name, start, end, _ in extract(FORM_FEED_SOURCE)] == [
+        ("a", 1, 4),
+        ("b", 5, 6),
+    ]
+
+
+@pytest.mark.parametrize("line_break", LINE_BREAKS)
+def test_extract_matches_splitlines_for_every_line_break(line_break):
+    source = line_break.join(["import os", "def a(x):", "    return x", "", "  def b():", "    pass", ""])
+    assert extract(source) == splitlines_extract(source)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        "x = 1",
+        "def only():\n    pass",
+        "def a():\n\n\ndef b():\n",
+        "def a():\n    pass\n\n",
+        "def \u00e9t\u00e9():\n  pass\ndef g():\n  pass\n",
+        "def _private():\n  pass\ndef \u03bb2(x):\n  return x\n",
+    ],
+)
+def test_extract_matches_splitlines_edge_cases(source):
+    assert extract(source) == splitlines_extract(source)
+
+
+def test_nodes_use_functions_supplied_without_extraction():
+    state = StateModel(functions=[{"function_name": "f", "source": "def f():\n    if x:\n        return 1"}])
+    _, state, message = asyncio.run(check_complexity_node(state, registered_tools))
+    assert message == "computed complexity for 1 functions"
+    assert state.metadata["complexity"] == [{"function_name": "f", "complexity": 3}]
+
+
+def test_function_sources_are_not_serialized():
+    _, state, _ = asyncio.run(extract_functions_node(StateModel(source_code="def f():\n    pass"), registered_tools))
+    assert state.function_sources == ["def f():\n    pass"]
+    assert "function_sources" not in state.model_dump()
+
+
+def test_batched_tools_survive_a_new_event_loop():
+    async def complexities():
+        return await asyncio.wait_for(
+            map_tool(registered_tools, "estimate_complexity", ["if a: return 1"]), timeout=1.0
+        )
+
+    async def abandon_pending_flush():
+        asyncio.ensure_future(map_tool(registered_tools, "estimate_complexity", ["while b: pass"]))
+        await asyncio.sleep(0)
+
+    asyncio.run(abandon_pending_flush())
+    assert asyncio.run(complexities()) == [3]
+
+
+def test_failing_source_only_fails_its_own_caller():
+    def shout(source):
+        if source == "bad":
+            raise ValueError("bad source")
+        return source.upper()
+
+    async def scenario():
+        batcher = ToolBatcher(shout)
+        return await asyncio.gather(batcher("a"), batcher("bad"), batcher("b"), return_exceptions=True)
+
+    first, failed, last = asyncio.run(scenario())
+    assert (first, last) == ("A", "B")
+    assert isinstance(failed, ValueError)
+
+
+def test_batches_flush_at_max_batch(monkeypatch):
+    batch_sizes = []
+
+    def recording_apply(tool, sources):
+        batch_sizes.append(len(sources))
+        return [(True, tool(source)) for source in sources]
+
+    monkeypatch.setattr(nodes_tools, "apply_tool_batch", recording_apply)
+
+    async def scenario():
+        batcher = ToolBatcher(str.upper, max_batch=2, max_wait_ms=20)
+        return await asyncio.gather(*(batcher(source) for source in "abcde"))
+
+    assert asyncio.run(scenario()) == ["A", "B", "C", "D", "E"]
+    assert batch_sizes == [2, 2, 1]
+
+
+def test_idle_batcher_does_not_wait_for_the_flush_timer():
+    async def scenario():
+        batcher = ToolBatcher(str.upper, max_wait_ms=10_000)
+        return await asyncio.wait_for(batcher("a"), timeout=1.0)
+
+    assert asyncio.run(scenario()) == "A"
+
+
+def test_cancelled_caller_does_not_disturb_shared_batch():
+    def slow_upper(source):
+        time.sleep(0.05)
+        return source.upper()
+
+    async def scenario():
+        loop_errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: loop_errors.append(context))
+        batcher = ToolBatcher(slow_upper)
+        callers = [asyncio.ensure_future(batcher(source)) for source in "abc"]
+        await asyncio.sleep(0.01)
+        callers[1].cancel()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0.1)
+        return results, loop_errors
+
+    results, loop_errors = asyncio.run(scenario())
+    assert results[0] == "A" and results[2] == "C"
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert loop_errors == []
@@ -0,0 +1,14 @@
+import pytest
+from pydantic import ValidationError
+
+from app.schemas import GraphSpec
+
+
+@pytest.mark.parametrize("max_queue", [-1, 0, 1])
+def test_max_queue_rejects_values_that_unbound_or_starve_the_stream(max_queue):
+    with pytest.raises(ValidationError):
+        GraphSpec(nodes=[], start_node="extract_functions", max_queue=max_queue)
+
+
+def test_max_queue_accepts_smallest_useful_buffer():
+    assert GraphSpec(nodes=[], start_node="extract_functions", max_queue=2).max_queue == 2